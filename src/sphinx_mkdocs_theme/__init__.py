@@ -3,8 +3,11 @@
 
 import os
 
+from sphinx.config import ENUM
+
 from .bridge import MkDocsTemplateBridge
 from .builder import MkDocsBuilder
+from .toc import PageTocCollector
 
 __all__ = ["setup", "MkDocsTemplateBridge"]
 __version__ = "0.0.1.dev0"
@@ -13,4 +16,35 @@ __version__ = "0.0.1.dev0"
 # Entry point for the sphinx extension
 def setup(app):
     app.add_config_value("mkdocs_theme", default=None, rebuild="html")
+    app.add_config_value("mkdocs_search_prebuild_timeout", default=None, rebuild="")
+    app.add_config_value("mkdocs_write_threads", default=0, rebuild="")
+    app.add_config_value("mkdocs_copy_threads", default=0, rebuild="")
+    app.add_config_value(
+        "mkdocs_copy_mode",
+        default="copy",
+        rebuild="",
+        types=ENUM("copy", "reflink", "hardlink"),
+    )
+    app.add_config_value("mkdocs_compress", default={}, rebuild="")
+    app.add_config_value("mkdocs_compress_min_size", default=1024, rebuild="")
+    app.add_config_value("mkdocs_jinja_bytecode_cache", default=True, rebuild="")
+    app.add_config_value("mkdocs_nav_fragment_cache", default=True, rebuild="")
+    app.add_config_value(
+        "mkdocs_highlight_cache_size", default=32 * 1024 * 1024, rebuild=""
+    )
+    app.add_config_value(
+        "mkdocs_nav_mode",
+        default="inline",
+        rebuild="html",
+        types=ENUM("inline", "shared"),
+    )
     app.add_builder(MkDocsBuilder)
+    app.add_env_collector(PageTocCollector)
+
+    return {
+        "version": __version__,
+        "env_version": 1,
+        # Pages written in parallel send their search entries back, for merging.
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
@@ -0,0 +1,336 @@
+"""Keep track of the theme assets written by earlier builds.
+"""
+
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from sphinx.util.osutil import copytimes
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ["AssetManifest", "OutputManifest", "get_context_digest", "place_file"]
+
+# From linux/fs.h
+_FICLONE = 0x40049409
+
+
+def _clone_file(source, destination):
+    """Copy `source` to `destination`, sharing the data if possible.
+
+    This tries a reflink and then os.copy_file_range(), which lets the
+    filesystem copy (or share) the data without it going through userspace.
+    """
+    with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+
+        if not hasattr(os, "copy_file_range"):
+            raise OSError("copy_file_range() is not available")
+        while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+            pass
+
+
+def place_file(source, destination, mode="copy"):
+    """Place a copy of `source` at `destination`, like Sphinx's copyfile().
+
+    `mode` is one of:
+
+    - "copy": a regular copy.
+    - "reflink": share the data with `source`, where the filesystem can.
+    - "hardlink": a hardlink to `source`, or a reflink if that isn't possible.
+
+    Each of these falls back to the next one, down to a regular copy.
+    """
+    if os.path.exists(destination):
+        if filecmp.cmp(source, destination):
+            return
+        # Never write through a link to another file (like a theme's source).
+        os.unlink(destination)
+
+    if mode == "hardlink":
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            pass
+
+    if mode in ("hardlink", "reflink"):
+        try:
+            _clone_file(source, destination)
+        except OSError:
+            pass
+        else:
+            copytimes(source, destination)
+            return
+
+    shutil.copyfile(source, destination)
+    try:
+        # don't do full copystat because the source may be read-only
+        copytimes(source, destination)
+    except OSError:
+        pass
+
+
+def _get_stat(path):
+    try:
+        result = os.stat(path)
+    except OSError:
+        return None
+    return [result.st_size, result.st_mtime_ns]
+
+
+def _get_file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_context_digest(*values):
+    """Get a digest of the values used to render a templated asset.
+
+    Values that can't be serialised are represented by their repr(), which
+    can only cause assets to be rendered again when they didn't need to be.
+    """
+    data = json.dumps(values, sort_keys=True, separators=(",", ":"), default=repr)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class AssetManifest:
+    """The inputs and output of every asset written, stored at `path`.
+
+    An asset is skipped when its source has the same content, it would be
+    rendered with the same context and the output hasn't been touched since
+    it was written. The content of a source is only hashed again when its
+    size or mtime changed.
+
+    Assets that were not looked at in a build are dropped from the manifest
+    when it is saved.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}  # destination -> entry
+        self._current = {}  # the entries looked at in this build
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self._current, f, separators=(",", ":"))
+
+    def is_current(self, destination, source, context_digest=None):
+        """Check if `destination` is already up to date.
+
+        Regardless of the result, :meth:`record` should be called once the
+        asset has been written.
+        """
+        entry = {
+            "source": source,
+            "stat": _get_stat(source),
+            "context": context_digest,
+        }
+        cached = self._entries.get(destination)
+        if (
+            cached is not None
+            and cached["source"] == source
+            and cached["stat"] == entry["stat"]
+        ):
+            entry["digest"] = cached["digest"]
+        else:
+            entry["digest"] = _get_file_digest(source)
+        self._current[destination] = entry
+
+        if cached is None or cached.get("output") != _get_stat(destination):
+            return False
+        return all(cached[key] == entry[key] for key in ("digest", "context"))
+
+    def record(self, destination):
+        """Record that `destination` was written (or skipped)."""
+        self._current[destination]["output"] = _get_stat(destination)
+
+
+class OutputManifest:
+    """The digest of every file written to `outdir`, stored at `path`.
+
+    Files are only written if their content changed, which keeps the mtimes
+    of everything else intact. The paths that were changed in a build, and
+    the ones that were removed, are written out by :meth:`save` for
+    incremental deploys.
+
+    Every file has an `owner`: the document it was written for, or None for
+    files that are written in every build (like theme assets).
+    """
+
+    def __init__(self, path, outdir):
+        self.path = path
+        self.outdir = outdir
+        self._files = {}  # path -> [digest, size, mtime_ns, owner]
+        self._written = {}  # the subset of _files written since take_updated()
+        self._changed = set()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._files = json.load(f)["files"]
+        except (OSError, ValueError, KeyError):
+            self._files = {}
+
+    def _get_key(self, filename):
+        return os.path.relpath(filename, self.outdir).replace(os.sep, "/")
+
+    def _is_unchanged(self, key, filename, digest):
+        cached = self._files.get(key)
+        return cached is not None and cached[:3] == [digest] + (
+            _get_stat(filename) or []
+        )
+
+    def _record(self, key, filename, digest, owner):
+        self._written[key] = self._files[key] = [digest] + _get_stat(filename) + [owner]
+
+    def write(self, filename, data, owner=None):
+        """Write `data` (bytes) to `filename`, unless it's already there."""
+        key = self._get_key(filename)
+        digest = hashlib.sha256(data).hexdigest()
+        if not self._is_unchanged(key, filename, digest):
+            # Never write through a link to another file (see place_file()).
+            if os.path.lexists(filename):
+                os.unlink(filename)
+            with open(filename, "wb") as f:
+                f.write(data)
+            self._changed.add(key)
+        self._record(key, filename, digest, owner)
+
+    def write_chunks(self, filename, chunks, owner=None):
+        """Like :meth:`write`, with the data coming from an iterable of bytes.
+
+        The data is written to a temporary file as it comes in, which only
+        replaces `filename` if the content changed.
+        """
+        key = self._get_key(filename)
+        temporary = f"{filename}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            digest = hashlib.sha256()
+            with open(temporary, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            digest = digest.hexdigest()
+
+            if not self._is_unchanged(key, filename, digest):
+                os.replace(temporary, filename)
+                self._changed.add(key)
+        finally:
+            if os.path.lexists(temporary):
+                os.unlink(temporary)
+        self._record(key, filename, digest, owner)
+
+    def check(self, filename, owner=None):
+        """Record a file that was written by something else."""
+        key = self._get_key(filename)
+        stat = _get_stat(filename)
+        if stat is None:
+            return
+
+        cached = self._files.get(key)
+        if cached is not None and cached[1:3] == stat:
+            digest = cached[0]
+        else:
+            digest = _get_file_digest(filename)
+            if cached is None or cached[0] != digest:
+                self._changed.add(key)
+        self._written[key] = self._files[key] = [digest] + stat + [owner]
+
+    def take_updated(self):
+        """Get (and forget) what was written since the last call.
+
+        This is used to send the files written in a worker process, back to
+        the main process, where they're passed to :meth:`merge`.
+        """
+        retval = (self._written, sorted(self._changed))
+        self._written, self._changed = {}, set()
+        return retval
+
+    def merge(self, updated):
+        written, changed = updated
+        self._files.update(written)
+        self._written.update(written)
+        self._changed.update(changed)
+
+    @property
+    def changed(self):
+        """The paths changed in this build."""
+        return frozenset(self._changed)
+
+    def _is_kept(self, key, owner, is_current):
+        if key in self._written:
+            return True
+        filename = os.path.join(self.outdir, key)
+        return owner is not None and is_current(owner) and os.path.exists(filename)
+
+    def get_current(self, is_current):
+        """Get the paths :meth:`expire` would keep, mapped to their owner."""
+        return {
+            key: owner
+            for key, (*_, owner) in self._files.items()
+            if self._is_kept(key, owner, is_current)
+        }
+
+    def expire(self, is_current):
+        """Remove the files that were not written in this build.
+
+        Files whose owner passes `is_current` are kept, since those are only
+        written when their owner changes. Returns the removed paths.
+        """
+        removed = []
+        for key, (*_, owner) in list(self._files.items()):
+            if self._is_kept(key, owner, is_current):
+                continue
+
+            filename = os.path.join(self.outdir, key)
+
+            del self._files[key]
+            removed.append(key)
+            if os.path.lexists(filename):
+                os.unlink(filename)
+
+            # Clean up the directories that are left empty.
+            parent = os.path.dirname(filename)
+            while os.path.normpath(parent) != os.path.normpath(self.outdir):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+
+        return sorted(removed)
+
+    def save(self, changes_path, removed=()):
+        """Save the manifest, and the paths changed in this build."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"files": self._files}, f, separators=(",", ":"))
+
+        changes = {"changed": sorted(self._changed), "removed": list(removed)}
+        with open(changes_path, "w", encoding="utf-8") as f:
+            json.dump(changes, f, indent=2)
@@ -3,38 +3,255 @@
 
 import os
 import html
+import json
+import site
+import posixpath
+import pickle
+import hashlib
+import logging
+import sysconfig
 import traceback
-from importlib.metadata import entry_points
+from collections import ChainMap
+from functools import partial
+from importlib import metadata
 
-from mkdocs.theme import Theme as MkDocsTheme
+import jinja2
+import mkdocs
+from jinja2 import FileSystemBytecodeCache
+from jinja2.utils import LRUCache
 from sphinx.application import TemplateBridge
 from sphinx.errors import ExtensionError
-from sphinx.util import mtimes_of_files
 
-from .translator import ContextTranslator
+from .translator import ContextTranslator, LazyValue
 
 __all__ = ["MkDocsTemplateBridge", "EventHandler"]
 
+logger = logging.getLogger(__name__)
+
+
+# Directories that are only changed by (un)installing packages.
+_INSTALL_PATHS = {sysconfig.get_paths()[key] for key in ("purelib", "platlib")}
+if site.ENABLE_USER_SITE and site.USER_SITE:
+    _INSTALL_PATHS.add(site.USER_SITE)
+
+
+def _is_installed(path):
+    path = os.path.abspath(path)
+    return any(path.startswith(prefix + os.sep) for prefix in _INSTALL_PATHS)
+
+
+def _newest_mtime_in(dirname, suffix, manifest, new_manifest):
+    """Get the newest mtime of the files with `suffix` in `dirname`, recursively.
+
+    `manifest` holds `(directory mtime, newest mtime, subdirectories)` for
+    every directory from an earlier scan. A directory's mtime only changes
+    when its entries do, so the files in directories with the same mtime
+    are not looked at again. Everything scanned is added to `new_manifest`.
+    """
+    try:
+        dir_mtime = os.stat(dirname).st_mtime
+    except OSError:
+        return None
+
+    cached = manifest.get(dirname)
+    if cached is not None and cached[0] == dir_mtime:
+        _, newest, subdirs = cached
+    else:
+        newest, subdirs = None, []
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    try:
+                        mtime = entry.stat().st_mtime
+                    except OSError:
+                        continue
+                    if newest is None or mtime > newest:
+                        newest = mtime
+    new_manifest[dirname] = (dir_mtime, newest, subdirs)
+
+    for subdir in subdirs:
+        mtime = _newest_mtime_in(subdir, suffix, manifest, new_manifest)
+        if mtime is not None and (newest is None or mtime > newest):
+            newest = mtime
+    return newest
+
+
+def _get_depth(url):
+    """Get how many directories deep `url` is, the way mkdocs' "url" filter does."""
+    head, tail = posixpath.split(url)
+    if "." in tail:
+        url = head
+    return len([part for part in url.split("/") if part])
+
+
+class _StandInPage:
+    """Stands in for `page`, while rendering a block for the fragment cache.
+
+    Only `url` should be used, by the "url" filter, which makes the links
+    relative to a directory that's as deep as the page. Using anything else
+    means that the block depends on the page, and can't be cached.
+    """
+
+    __slots__ = ("url", "used")
+
+    def __init__(self, depth):
+        # "\0" can't be in a real URL, so links relative to this never share
+        # a prefix with it, and it's easy to spot if it ends up in the output.
+        self.url = "\0/" * depth
+        self.used = False
+
+    def __getattr__(self, name):
+        self.used = True
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        self.used = True
+        raise KeyError(key)
+
+    def __eq__(self, other):
+        self.used = True
+        return NotImplemented
+
+    __hash__ = object.__hash__
+
+    def __bool__(self):
+        self.used = True
+        return True
+
+
+class _CachingBlocks(dict):
+    """The blocks of a Jinja context, with some of them going through `wrap`.
+
+    Blocks from parent templates are only added to this while rendering, so
+    they're wrapped when they're looked up.
+    """
+
+    def __init__(self, blocks, names, wrap):
+        super().__init__(blocks)
+        self._names = names
+        self._wrap = wrap
+
+    def __getitem__(self, name):
+        blocks = super().__getitem__(name)
+        # Blocks that call super() look themselves up in here, so only wrap the
+        # ones that are not overridden.
+        if name in self._names and len(blocks) == 1:
+            return [partial(self._wrap, name, blocks[0])]
+        return blocks
+
+
+def _find_theme_distribution(name):
+    """Find the distribution that provides the named mkdocs theme."""
+    for dist in metadata.distributions():
+        for ep in dist.entry_points:
+            if ep.group == "mkdocs.themes" and ep.name == name:
+                return dist.metadata["Name"], dist.version
+    return None
+
+
+def _load_cached_theme(name, cache_path):
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+    except Exception:  # missing, corrupted or from an incompatible version.
+        return None
+
+    if cached["name"] != name or cached["mkdocs"] != mkdocs.__version__:
+        return None
+    try:
+        version = metadata.version(cached["distribution"])
+    except metadata.PackageNotFoundError:
+        return None
+    if version != cached["version"]:
+        return None
+
+    theme = cached["theme"]
+    if not all(os.path.isdir(path) for path in theme.dirs):
+        return None
+    return theme
+
+
+def load_mkdocs_theme(name, cache_path):
+    """Load the named mkdocs theme, reusing the one from the last build if possible.
+
+    Finding the theme means looking through every installed distribution's
+    entry points, and loading it means parsing its configuration. Neither of
+    those change unless the distribution providing the theme (or mkdocs)
+    does, so the loaded theme is stored at `cache_path`.
+    """
+    theme = _load_cached_theme(name, cache_path)
+    if theme is not None:
+        return theme
+
+    # Check that the theme actually exists.
+    distribution = _find_theme_distribution(name)
+    if distribution is None:
+        raise ExtensionError("Could not find mkdocs theme named: {}".format(name))
+
+    from mkdocs.theme import Theme as MkDocsTheme
+
+    theme = MkDocsTheme(name)
+
+    dist_name, dist_version = distribution
+    cached = {
+        "name": name,
+        "mkdocs": mkdocs.__version__,
+        "distribution": dist_name,
+        "version": dist_version,
+        "theme": theme,
+    }
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "wb") as f:
+        pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+
+    return theme
+
 
 class MkDocsTemplateBridge(TemplateBridge):
     """A TemplateBridge that uses the mkdocs theme's Jinja2 environment for rendering.
     """
 
+    # How many templates from render_string() to keep compiled.
+    string_template_cache_size = 64
+
+    # The blocks that are rendered once per position in the navigation (and
+    # depth of the page), instead of once per page. Themes can turn this off
+    # with `nav_fragment_cache: false` in their mkdocs_theme.yml.
+    cached_blocks = ("site_nav",)
+    cached_block_cache_size = 256
+
     def init(self, builder, theme, dirs=None):
         user_provided = builder.app.config.mkdocs_theme
 
-        # Check that the theme actually exists.
-        theme_entry_points = entry_points()["mkdocs.themes"]
-        available_themes = {ep.name: ep.value for ep in theme_entry_points}
-        if user_provided not in available_themes:
-            raise ExtensionError(
-                "Could not find mkdocs theme named: {}".format(user_provided)
-            )
-
-        self.mkdocs_theme = MkDocsTheme(user_provided)
+        self.mkdocs_theme = load_mkdocs_theme(
+            user_provided, os.path.join(builder.doctreedir, "mkdocs_theme.pickle")
+        )
+        self._template_manifest_path = os.path.join(
+            builder.doctreedir, "mkdocs_templates.json"
+        )
 
         self._environment = self.mkdocs_theme.get_env()
+        if builder.config.mkdocs_jinja_bytecode_cache:
+            # Jinja checks the source's checksum before using a cached template,
+            # but the bytecode format is only guaranteed to match on the same
+            # version of Jinja.
+            cache_dir = os.path.join(
+                builder.doctreedir, "mkdocs_jinja2", jinja2.__version__
+            )
+            os.makedirs(cache_dir, exist_ok=True)
+            self._environment.bytecode_cache = FileSystemBytecodeCache(cache_dir)
         self._translator = ContextTranslator(builder.app, self.mkdocs_theme)
+        self._string_templates = LRUCache(self.string_template_cache_size)
+
+        self._block_cache = None
+        if builder.config.mkdocs_nav_fragment_cache and (
+            "nav_fragment_cache" not in self.mkdocs_theme
+            or self.mkdocs_theme["nav_fragment_cache"]
+        ):
+            self._block_cache = LRUCache(self.cached_block_cache_size)
+            self._uncacheable_blocks = set()
 
         # TODO: add in configuration from mkdocs_theme into the
         # RawConfigParser at theme.config
@@ -52,25 +269,137 @@ class MkDocsTemplateBridge(TemplateBridge):
         assert hasattr(self, "_environment"), "WHAT."
         return self._environment
 
+    def _generate(self, template, context):
+        # Not Template.render(), so that the blocks can be swapped out below.
+        jinja_context = template.new_context(context)
+        if self._block_cache is not None:
+            jinja_context.blocks = _CachingBlocks(
+                jinja_context.blocks, self.cached_blocks, self._render_cached_block
+            )
+        try:
+            yield from template.root_render_func(jinja_context)
+        except Exception:
+            self._environment.handle_exception()
+
+        computed = [
+            key
+            for key, value in context.items()
+            if isinstance(value, LazyValue) and value.computed
+        ]
+        logger.debug("rendering %s used: %s", template.name, ", ".join(computed))
+
+    def _render_cached_block(self, name, render_block, context):
+        # This is a block's render function, called in place of `render_block`.
+        # Templates from render_string() don't have a name, so the blocks are
+        # told apart by their render function instead.
+        # Variables set by the template (eg: from the page) aren't part of the
+        # key, so blocks are only cached when there are none.
+        page = context.resolve_or_missing("page")
+        if (
+            render_block in self._uncacheable_blocks
+            or context.vars
+            or not isinstance(getattr(page, "url", None), str)
+        ):
+            yield from render_block(context)
+            return
+
+        depth = _get_depth(page.url)
+        nav_path = self._translator.get_nav_path(page.url)
+        key = (render_block, context.name, nav_path, depth)
+        result = self._block_cache.get(key)
+        if result is None:
+            stand_in = _StandInPage(depth)
+            block_context = self._environment.context_class(
+                self._environment,
+                ChainMap({"page": stand_in}, context.vars, context.parent),
+                context.name,
+                {},
+            )
+            block_context.blocks = context.blocks
+            try:
+                result = "".join(render_block(block_context))
+            except Exception:
+                stand_in.used = True
+            if stand_in.used or "\0" in result:
+                logger.debug("not caching %s in %s", name, context.name)
+                self._uncacheable_blocks.add(render_block)
+                yield from render_block(context)
+                return
+            self._block_cache[key] = result
+        yield result
+
+    def _render(self, template, context):
+        return "".join(self._generate(template, context))
+
     def render(self, template, context):
         try:
             context, template = self._translator.translate(context, template)
-            return self._environment.get_template(template).render(context)
+            return self._render(self._environment.get_template(template), context)
         except Exception:
             return (
                 "Error occurred in MkDocsTemplateBridge.render()\n"
                 f"<pre>{html.escape(traceback.format_exc())}</pre>"
             )
 
+    def generate(self, template, context):
+        """Like render(), but yield the output in chunks as it's rendered.
+
+        Part of the output may have been used by the time an error occurs, so
+        errors are raised instead of being rendered into the output.
+        """
+        context, template = self._translator.translate(context, template)
+        return self._generate(self._environment.get_template(template), context)
+
+    def _get_string_template(self, source):
+        # Static assets are rendered with this, and many are identical.
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        template = self._string_templates.get(key)
+        if template is None:
+            template = self._environment.from_string(source)
+            self._string_templates[key] = template
+        return template
+
     def render_string(self, source, context):
         try:
             context, _ = self._translator.translate(context, template_name=None)
-            return self._environment.from_string(source).render(context)
+            return self._render(self._get_string_template(source), context)
         except Exception:
             return (
                 "Error occurred in MkDocsTemplateBridge.render_string()\n"
                 f"<pre>{html.escape(traceback.format_exc())}</pre>"
             )
 
+    def generate_string(self, source, context):
+        """Like render_string(), but yield the output in chunks; see generate()."""
+        context, _ = self._translator.translate(context, template_name=None)
+        return self._generate(self._get_string_template(source), context)
+
     def newest_template_mtime(self) -> float:
-        return max(mtimes_of_files(self.mkdocs_theme.dirs, ".html"))
+        try:
+            with open(self._template_manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+
+        # Files in other places (like a theme being developed) can be edited
+        # without changing their directory's mtime, so those are always
+        # scanned in full.
+        new_manifest = {}
+        mtimes = []
+        for dirname in self.mkdocs_theme.dirs:
+            mtime = _newest_mtime_in(
+                dirname,
+                ".html",
+                manifest if _is_installed(dirname) else {},
+                new_manifest,
+            )
+            if mtime is not None:
+                mtimes.append(mtime)
+
+        try:
+            with open(self._template_manifest_path, "w", encoding="utf-8") as f:
+                json.dump(new_manifest, f)
+        except OSError:
+            pass  # It's only a cache.
+
+        return max(mtimes, default=0)
@@ -1,34 +1,75 @@
 """A Sphinx Builder for building using an mkdocs theme.
 """
 
+import io
 import os
+import html
+import json
 import fnmatch
 import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 
+from jinja2 import TemplateError
 from sphinx.builders.html import (
     __,
+    INVENTORY_FILENAME,
     progress_message,
+    ImageAdapter,
     JavaScript,
     Stylesheet,
     Matcher,
-    copy_asset,
+    ThemeError,
+    ensuredir,
     movefile,
+    os_path,
+    relative_uri,
 )
 from sphinx.builders.dirhtml import DirectoryHTMLBuilder
-from mkdocs.contrib.search import SearchPlugin as MkDocsSearchPlugin
+from sphinx.util import status_iterator
+from sphinx.util.build_phase import BuildPhase
+from sphinx.util.console import bold
+from sphinx.util.inventory import InventoryFile
+from sphinx.util.parallel import ParallelTasks, make_chunks
 
+from .assets import AssetManifest, OutputManifest, get_context_digest, place_file
 from .bridge import MkDocsTemplateBridge
+from .compression import COMPRESSIBLE_SUFFIXES, SUFFIXES, compress, get_formats
+from .highlighting import CachedHighlighter, HighlightCache
 
 logger = logging.getLogger(__name__)
 
 
+def _is_write_error(exc):
+    # TemplateNotFound is an OSError too.
+    return isinstance(exc, OSError) and not isinstance(exc, TemplateError)
+
+
+def _join_chunks(chunks, size=1 << 16):
+    """Join the (many, small) chunks from Jinja, into chunks of about `size`."""
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
 class MkDocsBuilder(DirectoryHTMLBuilder):
     """Builder that uses mkdocs-like Jinja2 environment.
     """
 
     name = "mkdocs"
     searchindex_filename = os.path.join("search", "search_index.json")
+    navigation_filename = os.path.join("nav", "nav.json")
+
+    # Set while pages are being rendered on threads, see _write_serial()
+    _page_executor = None
 
     def get_builder_config(self, option, default):
         if (option, default) == ("use_index", "html"):
@@ -50,6 +91,529 @@ class MkDocsBuilder(DirectoryHTMLBuilder):
         super().init_highlighter()
         # This line took 73 minutes of digging through Sphinx/MkDocs/Docutils sources.
         self.highlighter.formatter_args["wrapcode"] = True
+
+        self.highlight_cache = None
+        if self.config.mkdocs_highlight_cache_size:
+            self.highlight_cache = HighlightCache(
+                os.path.join(self.doctreedir, "mkdocs_highlight.json"),
+                max_size=self.config.mkdocs_highlight_cache_size,
+            )
+            self.highlighter = CachedHighlighter(
+                self.highlighter, self.highlight_cache
+            )
+
+    def prepare_writing(self, docnames) -> None:
+        super().prepare_writing(docnames)
+        self.output_manifest = OutputManifest(
+            os.path.join(self.doctreedir, "mkdocs_output.json"), self.outdir
+        )
+        # All the toctrees are known by now, so compute the navigation once
+        # instead of once per page.
+        self.templates.translator.build_site_navigation()
+
+    def get_outdated_docs(self):
+        outdated = set()
+        for docname in super().get_outdated_docs():
+            outdated.add(docname)
+            yield docname
+
+        # The search index only has the entries of the pages written in this
+        # build, and the cached ones. Pages missing from the cache (eg: it was
+        # deleted, or made by another version of mkdocs) are written again.
+        indexer = self.templates.translator.indexer
+        if not indexer:
+            return
+        for docname in sorted(self.env.found_docs - outdated):
+            if not indexer.has_page(self.get_target_uri(docname)):
+                yield docname
+
+    def load_indexer(self, docnames) -> None:
+        # Sphinx's index isn't written, and the file it would load from is
+        # mkdocs' index. CachedSearchIndex keeps the entries across builds.
+        pass
+
+    #
+    # Parallel writing
+    #
+    def get_write_results(self):
+        """Collect (and forget) the per-page data from writing pages.
+
+        With parallel writes, this is called in the worker processes and the
+        result is passed to merge_write_results() in the main process.
+        """
+        results = {}
+        indexer = self.templates.translator.indexer
+        if indexer:
+            results["search"] = indexer.take_updated()
+        results["output"] = self.output_manifest.take_updated()
+        if self.highlight_cache:
+            results["highlight"] = self.highlight_cache.take_updated()
+        return results
+
+    def merge_write_results(self, results) -> None:
+        indexer = self.templates.translator.indexer
+        if "search" in results:
+            indexer.merge(results["search"])
+        self.output_manifest.merge(results["output"])
+        if "highlight" in results:
+            self.highlight_cache.merge(results["highlight"])
+
+    def _write_parallel(self, docnames, nproc) -> None:
+        # Mirrors Builder._write_parallel from Sphinx 3.2, except that the
+        # workers send back what they collected while rendering, which would
+        # be lost otherwise.
+        def write_process(docs):
+            self.app.phase = BuildPhase.WRITING
+            self.get_write_results()  # drop whatever the main process had.
+            for docname, doctree in docs:
+                self.write_doc(docname, doctree)
+            return self.get_write_results()
+
+        def merge(docs, results):
+            self.merge_write_results(results)
+
+        # warm up caches/compile templates using the first document
+        firstname, docnames = docnames[0], docnames[1:]
+        self.app.phase = BuildPhase.RESOLVING
+        doctree = self.env.get_and_resolve_doctree(firstname, self)
+        self.app.phase = BuildPhase.WRITING
+        self.write_doc_serialized(firstname, doctree)
+        self.write_doc(firstname, doctree)
+
+        tasks = ParallelTasks(nproc)
+        chunks = make_chunks(docnames, nproc)
+
+        self.app.phase = BuildPhase.RESOLVING
+        for chunk in status_iterator(
+            chunks,
+            __("writing output... "),
+            "darkgreen",
+            len(chunks),
+            self.app.verbosity,
+        ):
+            arg = []
+            for docname in chunk:
+                doctree = self.env.get_and_resolve_doctree(docname, self)
+                self.write_doc_serialized(docname, doctree)
+                arg.append((docname, doctree))
+            tasks.add_task(write_process, arg, merge)
+
+        # make sure all threads have finished
+        logger.info(bold(__("waiting for workers...")))
+        tasks.join()
+
+    #
+    # Threaded writing
+    #
+    def _write_serial(self, docnames) -> None:
+        threads = self.config.mkdocs_write_threads
+        if not threads:
+            return super()._write_serial(docnames)
+
+        # The doctrees are still converted to HTML one at a time, here. Only
+        # handle_page(), which renders the templates and writes the files, is
+        # done on the threads.
+        self._page_futures = []
+        # Bounds how many pages (and their bodies) are waiting to be rendered.
+        self._page_slots = threading.BoundedSemaphore(threads * 2)
+        with ThreadPoolExecutor(threads, thread_name_prefix="mkdocs-write") as pool:
+            self._page_executor = pool
+            try:
+                super()._write_serial(docnames)
+            finally:
+                self._page_executor = None
+
+        # Report the errors in the same order as a serial build would.
+        futures, self._page_futures = self._page_futures, []
+        for future in futures:
+            future.result()
+
+    def handle_page(self, *args, **kwargs) -> None:
+        if self._page_executor is None:
+            return self._handle_page(*args, **kwargs)
+
+        self._page_slots.acquire()
+        future = self._page_executor.submit(self._handle_page, *args, **kwargs)
+        future.add_done_callback(lambda _: self._page_slots.release())
+        self._page_futures.append(future)
+
+    def _handle_page(
+        self,
+        pagename,
+        addctx,
+        templatename="page.html",
+        outfilename=None,
+        event_arg=None,
+    ) -> None:
+        # Mirrors StandaloneHTMLBuilder.handle_page from Sphinx 3.2 (which is
+        # why Sphinx is pinned), except for how the output (and the page's
+        # source) is written.
+        ctx = self.globalcontext.copy()
+        # current_page_name is backwards compatibility
+        ctx["pagename"] = ctx["current_page_name"] = pagename
+        ctx["encoding"] = self.config.html_output_encoding
+        default_baseuri = self.get_target_uri(pagename)
+        # in the singlehtml builder, default_baseuri still contains an #anchor
+        # part, which relative_uri doesn't really like...
+        default_baseuri = default_baseuri.rsplit("#", 1)[0]
+
+        if self.config.html_baseurl:
+            ctx["pageurl"] = posixpath.join(
+                self.config.html_baseurl, pagename + self.out_suffix
+            )
+        else:
+            ctx["pageurl"] = None
+
+        def pathto(otheruri, resource=False, baseuri=default_baseuri):
+            if resource and "://" in otheruri:
+                # allow non-local resources given by scheme
+                return otheruri
+            elif not resource:
+                otheruri = self.get_target_uri(otheruri)
+            uri = relative_uri(baseuri, otheruri) or "#"
+            if uri == "#" and not self.allow_sharp_as_current_path:
+                uri = baseuri
+            return uri
+
+        ctx["pathto"] = pathto
+
+        def css_tag(css):
+            attrs = []
+            for key in sorted(css.attributes):
+                value = css.attributes[key]
+                if value is not None:
+                    attrs.append('%s="%s"' % (key, html.escape(value, True)))
+            attrs.append('href="%s"' % pathto(css.filename, resource=True))
+            return "<link %s />" % " ".join(attrs)
+
+        ctx["css_tag"] = css_tag
+
+        def hasdoc(name):
+            if name in self.env.all_docs:
+                return True
+            elif name == "search" and self.search:
+                return True
+            elif name == "genindex" and self.get_builder_config("use_index", "html"):
+                return True
+            return False
+
+        ctx["hasdoc"] = hasdoc
+
+        ctx["toctree"] = lambda **kwargs: self._get_local_toctree(pagename, **kwargs)
+        self.add_sidebars(pagename, ctx)
+        ctx.update(addctx)
+
+        self.update_page_context(pagename, templatename, ctx, event_arg)
+        newtmpl = self.app.emit_firstresult(
+            "html-page-context", pagename, templatename, ctx, event_arg
+        )
+        if newtmpl:
+            templatename = newtmpl
+
+        if not outfilename:
+            outfilename = self.get_outfilename(pagename)
+        # Stream the page into the file, instead of holding all of it in memory.
+        failed = False
+        try:
+            self.write_output(
+                outfilename,
+                self.templates.generate(templatename, ctx),
+                ctx["encoding"],
+                owner=pagename,
+            )
+        except Exception as exc:
+            if not _is_write_error(exc):
+                failed = True
+            else:
+                logger.warning(__("error writing file %s: %s"), outfilename, exc)
+        if failed:
+            # Fall back to render(), which renders the error into the page.
+            self._write_page(pagename, templatename, ctx, outfilename)
+        if self.copysource and ctx.get("sourcename"):
+            # copy the source file for the "show source" link
+            source_name = os.path.join(
+                self.outdir, "_sources", os_path(ctx["sourcename"])
+            )
+            ensuredir(os.path.dirname(source_name))
+            self.copy_file(self.env.doc2path(pagename), source_name, owner=pagename)
+
+    def _write_page(self, pagename, templatename, ctx, outfilename) -> None:
+        try:
+            output = self.templates.render(templatename, ctx)
+        except UnicodeError:
+            logger.warning(
+                __(
+                    "a Unicode error occurred when rendering the page %s. "
+                    "Please make sure all config values that contain "
+                    "non-ASCII content are Unicode strings."
+                ),
+                pagename,
+            )
+            return
+        except Exception as exc:
+            raise ThemeError(
+                __("An error happened in rendering the page %s.\nReason: %r")
+                % (pagename, exc)
+            ) from exc
+
+        try:
+            self.write_output(outfilename, output, ctx["encoding"], owner=pagename)
+        except OSError as err:
+            logger.warning(__("error writing file %s: %s"), outfilename, err)
+
+    #
+    # Writing output
+    #
+    def write_output(self, filename, text, encoding="utf-8", owner=None) -> None:
+        """Write `text` to `filename`, if that changes the file.
+
+        `text` can also be bytes, which are written as-is, or an iterable of
+        strings, which is written as it's iterated over.
+        """
+        ensuredir(os.path.dirname(filename))
+        if isinstance(text, bytes):
+            self.output_manifest.write(filename, text, owner=owner)
+        elif isinstance(text, str):
+            data = text.encode(encoding, "xmlcharrefreplace")
+            self.output_manifest.write(filename, data, owner=owner)
+        else:
+            chunks = (
+                chunk.encode(encoding, "xmlcharrefreplace")
+                for chunk in _join_chunks(text)
+            )
+            self.output_manifest.write_chunks(filename, chunks, owner=owner)
+
+    def is_current_owner(self, owner) -> bool:
+        # Pages are only written when their document changes, and Sphinx only
+        # tracks the images used by the documents written in this build.
+        return owner in self.env.found_docs or owner == self.imagedir
+
+    def write_buildinfo(self) -> None:
+        buffer = io.StringIO()
+        self.build_info.dump(buffer)
+        try:
+            filename = os.path.join(self.outdir, ".buildinfo")
+            self.write_output(filename, buffer.getvalue())
+        except OSError as exc:
+            logger.warning(__("Failed to write build info file: %r"), exc)
+
+    @progress_message(__("dumping object inventory"))
+    def dump_inventory(self) -> None:
+        # InventoryFile can only write to a file, so it's written elsewhere and
+        # then placed in the output, if it changed.
+        temporary = os.path.join(self.doctreedir, INVENTORY_FILENAME + ".tmp")
+        try:
+            InventoryFile.dump(temporary, self.env, self)
+            with open(temporary, "rb") as f:
+                data = f.read()
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+        self.write_output(os.path.join(self.outdir, INVENTORY_FILENAME), data)
+
+    def compress_output(self) -> None:
+        """Write precompressed variants of the text files in the output.
+
+        Only the files that changed in this build are compressed again, unless
+        the compression settings changed.
+        """
+        formats = get_formats(self.config.mkdocs_compress)
+        min_size = self.config.mkdocs_compress_min_size
+
+        settings_path = os.path.join(self.doctreedir, "mkdocs_compress.json")
+        settings = {"formats": formats, "min_size": min_size}
+        try:
+            with open(settings_path, encoding="utf-8") as f:
+                recompress = json.load(f) != settings
+        except (OSError, ValueError):
+            recompress = True
+        changed = self.output_manifest.changed
+
+        # The compressed files don't have an owner, so that they're removed along
+        # with the original, or when compression is turned off.
+        def compress_file(key):
+            filename = os.path.join(self.outdir, key)
+            if os.path.getsize(filename) < min_size:
+                return
+
+            data = None
+            for format_, level in formats.items():
+                compressed = filename + SUFFIXES[format_]
+                if recompress or key in changed or not os.path.exists(compressed):
+                    if data is None:
+                        with open(filename, "rb") as f:
+                            data = f.read()
+                    self.output_manifest.write(
+                        compressed, compress(data, format_, level)
+                    )
+                else:
+                    self.output_manifest.check(compressed)
+
+        files = self.output_manifest.get_current(self.is_current_owner)
+        to_compress = sorted(
+            key for key in files if key.endswith(COMPRESSIBLE_SUFFIXES)
+        )
+        for _, err in status_iterator(
+            self.map_copies(compress_file, to_compress),
+            __("compressing output... "),
+            "brown",
+            len(to_compress),
+            self.app.verbosity,
+            stringify_func=lambda result: result[0],
+        ):
+            if err is not None:
+                raise err
+
+        with open(settings_path, "w", encoding="utf-8") as f:
+            json.dump(settings, f)
+
+    def write_output_manifest(self) -> None:
+        removed = self.output_manifest.expire(self.is_current_owner)
+        self.output_manifest.save(
+            os.path.join(self.doctreedir, "mkdocs_changes.json"), removed
+        )
+
+    #
+    # Threaded copying
+    #
+    def copy_file(self, source, destination, owner=None) -> None:
+        """Copy a file that's used as-is, as configured by mkdocs_copy_mode."""
+        place_file(source, destination, self.config.mkdocs_copy_mode)
+        self.output_manifest.check(destination, owner=owner)
+
+    def copy_asset_file(self, source, destination, context=None) -> None:
+        """Like Sphinx's copy_asset_file(), with files written by this builder."""
+        basename = os.path.basename(source)
+        if context is not None and basename.lower().endswith("_t"):
+            with open(source, encoding="utf-8") as f:
+                text = self.templates.render_string(f.read(), context)
+            self.write_output(os.path.join(destination, basename[:-2]), text)
+        else:
+            self.copy_file(source, os.path.join(destination, basename))
+
+    def map_copies(self, func, items):
+        """Call `func` with every item, on threads if configured.
+
+        Yields `(item, error)` in the order of `items`, with `error` being
+        None if the call succeeded. This keeps the reported errors the same
+        regardless of the order in which the copies finish.
+        """
+        threads = self.config.mkdocs_copy_threads
+        if not threads or len(items) < 2:
+            for item in items:
+                try:
+                    func(item)
+                except Exception as err:
+                    yield item, err
+                else:
+                    yield item, None
+            return
+
+        with ThreadPoolExecutor(threads, thread_name_prefix="mkdocs-copy") as pool:
+            futures = [pool.submit(func, item) for item in items]
+            for item, future in zip(items, futures):
+                yield item, future.exception()
+
+    def _find_asset_files(self, source, destination, excluded):
+        """Find the files copy_asset() would copy, creating the directories."""
+        if not os.path.exists(source):
+            return []
+
+        ensuredir(destination)
+        if os.path.isfile(source):
+            return [(source, destination)]
+
+        retval = []
+        for root, dirs, files in os.walk(source, followlinks=True):
+            reldir = os.path.relpath(root, source)
+            for dirname in dirs[:]:
+                if excluded(os.path.normpath(os.path.join(reldir, dirname))):
+                    dirs.remove(dirname)
+                else:
+                    ensuredir(os.path.join(destination, reldir, dirname))
+
+            for filename in files:
+                if not excluded(os.path.normpath(os.path.join(reldir, filename))):
+                    retval.append(
+                        (
+                            os.path.join(root, filename),
+                            os.path.normpath(os.path.join(destination, reldir)),
+                        )
+                    )
+        return retval
+
+    def copy_image_files(self) -> None:
+        if not self.images:
+            return
+
+        def copy_image(src):
+            self.copy_file(
+                os.path.join(self.srcdir, src),
+                os.path.join(self.outdir, self.imagedir, self.images[src]),
+                owner=self.imagedir,
+            )
+
+        get_original_image_uri = ImageAdapter(self.app.env).get_original_image_uri
+        ensuredir(os.path.join(self.outdir, self.imagedir))
+        for src, err in status_iterator(
+            self.map_copies(copy_image, list(self.images)),
+            __("copying images... "),
+            "brown",
+            len(self.images),
+            self.app.verbosity,
+            stringify_func=lambda result: get_original_image_uri(result[0]),
+        ):
+            if err is not None:
+                logger.warning(
+                    __("cannot copy image file %r: %s"),
+                    os.path.join(self.srcdir, src),
+                    err,
+                )
+
+    def copy_download_files(self) -> None:
+        if not self.env.dlfiles:
+            return
+
+        def copy_download(src):
+            dest = os.path.join(self.outdir, "_downloads", self.env.dlfiles[src][1])
+            ensuredir(os.path.dirname(dest))
+            self.copy_file(os.path.join(self.srcdir, src), dest)
+
+        ensuredir(os.path.join(self.outdir, "_downloads"))
+        for src, err in status_iterator(
+            self.map_copies(copy_download, list(self.env.dlfiles)),
+            __("copying downloadable files... "),
+            "brown",
+            len(self.env.dlfiles),
+            self.app.verbosity,
+            stringify_func=lambda result: os.path.relpath(result[0], self.srcdir),
+        ):
+            if isinstance(err, OSError):
+                logger.warning(
+                    __("cannot copy downloadable file %r: %s"),
+                    os.path.join(self.srcdir, src),
+                    err,
+                )
+            elif err is not None:
+                raise err
+
+    def copy_extra_files(self) -> None:
+        try:
+            with progress_message(__("copying extra files")):
+                excluded = Matcher(self.config.exclude_patterns)
+                to_copy = []
+                for extra_path in self.config.html_extra_path:
+                    entry = os.path.join(self.confdir, extra_path)
+                    to_copy.extend(self._find_asset_files(entry, self.outdir, excluded))
+
+                for _, err in self.map_copies(
+                    lambda item: self.copy_asset_file(*item), to_copy
+                ):
+                    if err is not None:
+                        raise err
+        except OSError as err:
+            logger.warning(__("cannot copy extra file %r"), err)
+
     #
     # We don't create the _static directory!
     #
@@ -71,15 +635,20 @@ class MkDocsBuilder(DirectoryHTMLBuilder):
 
     def copy_html_static_files(self, context) -> None:
         excluded = Matcher(self.config.exclude_patterns + ["**/.*"])
+        to_copy = []
         for entry in self.config.html_static_path:
-            copy_asset(
-                os.path.join(self.confdir, entry),
-                self.outdir,
-                excluded,
-                context=context,
-                renderer=self.templates,
+            to_copy.extend(
+                self._find_asset_files(
+                    os.path.join(self.confdir, entry), self.outdir, excluded
+                )
             )
 
+        for _, err in self.map_copies(
+            lambda item: self.copy_asset_file(*item, context=context), to_copy
+        ):
+            if err is not None:
+                raise err
+
     def add_js_file(self, filename: str, **kwargs: str) -> None:
         self.script_files.append(JavaScript(filename, **kwargs))
 
@@ -90,15 +659,32 @@ class MkDocsBuilder(DirectoryHTMLBuilder):
         if not self.config.html_logo:
             return
 
-        copy_asset(os.path.join(self.confdir, self.config.html_logo), self.outdir)
+        self._copy_conf_file(self.config.html_logo)
 
     def copy_html_favicon(self) -> None:
-        if not self.config.html_logo:
+        if not self.config.html_favicon:
             return
 
-        copy_asset(os.path.join(self.confdir, self.config.html_favicon), self.outdir)
+        self._copy_conf_file(self.config.html_favicon)
+
+    def _copy_conf_file(self, filename) -> None:
+        source = os.path.join(self.confdir, filename)
+        if os.path.exists(source):
+            ensuredir(self.outdir)
+            self.copy_file(source, os.path.join(self.outdir, os.path.basename(source)))
 
     def finish(self) -> None:
+        # We want our own search index. Prebuilding it takes a while, so start
+        # doing that now, and let it happen while everything else is written.
+        indexer = self.templates.translator.indexer
+        if indexer:
+            # Only the pages written in this build have been indexed. The rest
+            # come from the previous builds.
+            indexer.select(
+                self.get_target_uri(docname) for docname in sorted(self.env.found_docs)
+            )
+            indexer.start_prebuild()
+
         self.finish_tasks.add_task(self.gen_pages_from_extensions)
         self.finish_tasks.add_task(self.gen_additional_pages)
         self.finish_tasks.add_task(self.copy_image_files)
@@ -108,10 +694,15 @@ class MkDocsBuilder(DirectoryHTMLBuilder):
         self.finish_tasks.add_task(self.write_buildinfo)
         self.finish_tasks.add_task(self.dump_inventory)
 
-        # We want our own search index.
-        translator = self.templates.translator
-        if translator.indexer:
+        if indexer:
             self.finish_tasks.add_task(self.dump_search_files)
+        if self.config.mkdocs_nav_mode == "shared":
+            self.finish_tasks.add_task(self.dump_navigation)
+        if self.config.mkdocs_compress:
+            self.finish_tasks.add_task(self.compress_output)
+        self.finish_tasks.add_task(self.write_output_manifest)
+        if self.highlight_cache:
+            self.finish_tasks.add_task(self.highlight_cache.save)
 
     def copy_theme_static_files(self, context) -> None:
         """Mimic mkdocs's theme asset copy behavior."""
@@ -135,17 +726,34 @@ class MkDocsBuilder(DirectoryHTMLBuilder):
                     return False
             return True
 
-        to_write = []
-        environment = self.templates.environment
-        for path in environment.list_templates(filter_func=exclude_filter):
-            path = os.path.normpath(path)
-
-            for location in self.templates.translator.theme.dirs:
-                if os.path.isfile(os.path.join(location, path)):
-                    to_write.append((location, path))
-                    break
-
-        for location, path in to_write:
+        # One walk per theme directory, instead of probing every directory for
+        # every template. Earlier directories take precedence, like in the
+        # Jinja loader.
+        to_write = {}
+        for location in self.templates.translator.theme.dirs:
+            for dirpath, _, filenames in os.walk(location):
+                for filename in filenames:
+                    path = os.path.relpath(os.path.join(dirpath, filename), location)
+                    if path in to_write or not exclude_filter(
+                        path.replace(os.sep, "/")
+                    ):
+                        continue
+                    to_write[path] = location
+
+        manifest = AssetManifest(os.path.join(self.doctreedir, "mkdocs_assets.json"))
+        # Rendered files can use the navigation, along with the context, and
+        # include (or extend) any of the theme's templates.
+        context_digest = get_context_digest(
+            context,
+            self.templates.newest_template_mtime(),
+            [
+                (type(item).__name__, item.title, item.url)
+                for item in self.templates.translator.get_all_pages()
+            ],
+        )
+
+        def write_asset(item):
+            path, location = item
             source = os.path.join(location, path)
             destination = os.path.join(self.outdir, path)
             renderer = self.templates
@@ -155,25 +763,74 @@ class MkDocsBuilder(DirectoryHTMLBuilder):
 
             # HACK: We only "render" template-y files.
             if "templates" not in location:
-                copy_asset(source, os.path.dirname(destination))
-                continue
-
-            os.makedirs(parent_dir, exist_ok=True)
-            with open(source, "r") as fsrc:
-                with open(destination, "w", encoding="utf-8") as fdst:
+                if not manifest.is_current(destination, source):
+                    os.makedirs(parent_dir, exist_ok=True)
+                    self.copy_file(source, destination)
+                else:
+                    self.output_manifest.check(destination)
+                manifest.record(destination)
+                return
+
+            if not manifest.is_current(destination, source, context_digest):
+                with open(source, "r") as fsrc:
                     source_text = fsrc.read()
+                failed = False
+                try:
+                    self.write_output(
+                        destination, renderer.generate_string(source_text, context)
+                    )
+                except Exception as exc:
+                    if _is_write_error(exc):
+                        raise
+                    failed = True
+                if failed:
+                    # render_string() renders the error into the file.
                     result = renderer.render_string(source_text, context)
-                    fdst.write(result)
+                    self.write_output(destination, result)
+            else:
+                self.output_manifest.check(destination)
+            manifest.record(destination)
+
+        for _, err in self.map_copies(write_asset, sorted(to_write.items())):
+            if err is not None:
+                raise err
+
+        manifest.save()
+
+    def dump_navigation(self) -> None:
+        # The pages only have the parts of the navigation that lead to them.
+        navigation = self.templates.translator.get_shared_navigation()
+        self.write_output(
+            os.path.join(self.outdir, self.navigation_filename),
+            json.dumps(navigation, sort_keys=True, separators=(",", ":")),
+        )
 
     def dump_search_files(self) -> None:
-        indexer = self.templates.translator.indexer
+        # Mirrors mkdocs' SearchPlugin.on_post_build(), with the files only
+        # being written if they changed.
+        from mkdocs.contrib import search as mkdocs_search
 
-        # HACK: Yes, I felt dirty after writing this.
-        plugin = MkDocsSearchPlugin()
-        plugin.search_index = indexer
-        plugin.config = indexer.config
+        indexer = self.templates.translator.indexer
+        output_dir = os.path.join(self.outdir, "search")
 
         try:
-            plugin.on_post_build(indexer.config)
+            search_index = indexer.generate_search_index()
         except ZeroDivisionError:
             raise Exception("FATAL (sphinx-mkdocs-theme): Document URLs are incorrect.")
+        self.write_output(os.path.join(output_dir, "search_index.json"), search_index)
+
+        # The language support files, for languages other than English.
+        languages = indexer.config["lang"]
+        filenames = []
+        if len(languages) > 1 or "en" not in languages:
+            filenames.append("lunr.stemmer.support.js")
+        if len(languages) > 1:
+            filenames.append("lunr.multi.js")
+        filenames.extend(f"lunr.{lang}.js" for lang in languages if lang != "en")
+        for filename in filenames:
+            self.copy_file(
+                os.path.join(mkdocs_search.base_path, "lunr-language", filename),
+                os.path.join(output_dir, filename),
+            )
+
+        indexer.save()
@@ -0,0 +1,42 @@
+"""Precompressed variants of the output, for servers that can use them.
+"""
+
+import gzip
+import logging
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ["SUFFIXES", "COMPRESSIBLE_SUFFIXES", "compress", "get_formats"]
+
+logger = logging.getLogger(__name__)
+
+# format -> the suffix of the compressed file
+SUFFIXES = {"gzip": ".gz", "br": ".br"}
+
+# Only text files benefit from this, everything else is compressed already.
+COMPRESSIBLE_SUFFIXES = (".html", ".css", ".js", ".json")
+
+
+def get_formats(config):
+    """Get the usable formats (and their level) from `mkdocs_compress`."""
+    retval = {}
+    for format_, level in config.items():
+        if format_ not in SUFFIXES:
+            logger.warning("Unknown compression format %r, skipping it.", format_)
+        elif format_ == "br" and brotli is None:
+            logger.warning("brotli is not installed, skipping brotli compression.")
+        else:
+            retval[format_] = int(level)
+    return retval
+
+
+def compress(data, format_, level):
+    if format_ == "gzip":
+        # No mtime, so that the same input always gives the same output.
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if format_ == "br":
+        return brotli.compress(data, quality=level)
+    raise ValueError(f"Unknown compression format: {format_!r}")
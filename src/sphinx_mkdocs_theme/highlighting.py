@@ -0,0 +1,166 @@
+"""Remember the highlighted code blocks across builds.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import pygments
+import sphinx
+from sphinx.highlighting import lexers
+from sphinx.util import logging as sphinx_logging
+
+from .assets import get_context_digest
+
+__all__ = ["HighlightCache", "CachedHighlighter"]
+
+
+class _WarningRecorder(logging.Filter):
+    """Note the warnings logged by the current thread."""
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            self._local.warned = True
+        return True
+
+    def reset(self):
+        self._local.warned = False
+
+    @property
+    def warned(self):
+        return getattr(self._local, "warned", False)
+
+
+# Sphinx warns about unknown lexers and code that could not be lexed, which
+# would not happen again if the result came from the cache.
+_highlighting_warnings = _WarningRecorder()
+sphinx_logging.getLogger("sphinx.highlighting").logger.addFilter(
+    _highlighting_warnings
+)
+
+
+class HighlightCache:
+    """Highlighted code, keyed by a digest of everything used to highlight it.
+
+    The cache is stored at `path`. When it's saved, the least recently used
+    entries are dropped until it holds at most `max_size` characters of code.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> highlighted, least recent first
+        self._updated = {}  # the entries added since take_updated()
+        self._used = set()  # the entries looked up since take_updated()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries = OrderedDict(json.load(f)["entries"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self._entries = OrderedDict()
+
+    def save(self):
+        with self._lock:
+            size = sum(len(value) for value in self._entries.values())
+            while size > self.max_size:
+                _, value = self._entries.popitem(last=False)
+                size -= len(value)
+            entries = list(self._entries.items())
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"entries": entries}, f, separators=(",", ":"))
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._used.add(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = self._updated[key] = value
+
+    def take_updated(self):
+        """Get (and forget) the entries added and used since the last call.
+
+        This is used to send the entries from a worker process, back to the
+        main process, where they're passed to :meth:`merge`.
+        """
+        with self._lock:
+            retval = (self._updated, sorted(self._used))
+            self._updated, self._used = {}, set()
+        return retval
+
+    def merge(self, updated):
+        entries, used = updated
+        with self._lock:
+            self._entries.update(entries)
+            for key in used:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+
+
+class CachedHighlighter:
+    """A PygmentsBridge, that looks up highlighted code in a HighlightCache.
+
+    Everything other than highlight_block() comes from the wrapped bridge.
+    """
+
+    __slots__ = ("highlighter", "cache")
+
+    def __init__(self, highlighter, cache):
+        self.highlighter = highlighter
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.highlighter, name)
+
+    def _get_key(self, source, lang, opts, force, kwargs):
+        # Lexers added by extensions are only known by their class.
+        lexer = lexers.get(lang)
+        if lexer is not None:
+            lexer = "{0.__module__}.{0.__qualname__}".format(type(lexer))
+        return get_context_digest(
+            pygments.__version__,
+            sphinx.__version__,
+            self.highlighter.dest,
+            self.highlighter.formatter_args,
+            source,
+            lang,
+            lexer,
+            opts,
+            force,
+            kwargs,
+        )
+
+    def highlight_block(
+        self, source, lang, opts=None, force=False, location=None, **kwargs
+    ):
+        if not isinstance(source, str):
+            source = source.decode()
+
+        key = self._get_key(source, lang, opts, force, kwargs)
+        highlighted = self.cache.get(key)
+        if highlighted is not None:
+            return highlighted
+
+        _highlighting_warnings.reset()
+        highlighted = self.highlighter.highlight_block(
+            source, lang, opts, force, location, **kwargs
+        )
+        # Keep these uncached, so that they are warned about on every build.
+        if not _highlighting_warnings.warned:
+            self.cache.set(key, highlighted)
+        return highlighted
@@ -5,10 +5,14 @@
 # Permanently borrowed from the mkdocs' `nav.py`
 #
 class Navigation:
-    def __init__(self, items, pages, homepage):
+    __slots__ = ("items", "pages", "homepage", "shared_url")
+
+    def __init__(self, items, pages, homepage, shared_url=None):
         self.items = items  # Nested List with full navigation of Sections, Pages, and Links.
         self.pages = pages  # Flat List of subset of Pages in nav, in order.
         self.homepage = homepage
+        # Where the full navigation is, when it's not all in `items`.
+        self.shared_url = shared_url
 
     def __repr__(self):
         return "Navigation: " + (
@@ -20,3 +24,209 @@ class Navigation:
 
     def __len__(self):
         return len(self.items)
+
+
+#
+# The items in the navigation are shared by every page in a build, so these
+# should not be modified once the navigation has been built. The per-page state
+# is held by ActiveItem instead.
+#
+class Section:
+    __slots__ = ("title", "url", "children", "parent", "previous_page", "next_page")
+
+    # Guaranteed constants
+    active = False
+    is_section = True
+    is_page = False
+    is_link = False
+
+    def __init__(self, title, url, children, parent=None):
+        self.title = title
+        self.url = url  # Unlike mkdocs, a section is also a document in Sphinx.
+        self.children = children
+        self.parent = parent
+        self.previous_page = None
+        self.next_page = None
+
+    def __repr__(self):
+        return "Section(title={!r})".format(self.title)
+
+    def _indent_print(self, depth=0):
+        ret = ['{}{}'.format('    ' * depth, repr(self))]
+        for item in self.children:
+            ret.append(item._indent_print(depth + 1))
+        return '\n'.join(ret)
+
+
+class Page:
+    __slots__ = (
+        "title",
+        "url",
+        "parent",
+        "active",
+        "is_homepage",
+        "content",
+        "meta",
+        "toc",
+        "abs_url",
+        "canonical_url",
+        "edit_url",
+        "previous_page",
+        "next_page",
+    )
+
+    # Guaranteed constants
+    children = None
+    is_section = False
+    is_page = True
+    is_link = False
+
+    def __init__(
+        self,
+        title,
+        url,
+        parent=None,
+        active=False,
+        is_homepage=False,
+        content=None,
+        meta=None,
+        toc=None,
+        abs_url=None,
+        canonical_url=None,
+        edit_url=None,
+        previous_page=None,
+        next_page=None,
+    ):
+        self.title = title
+        self.url = url
+        self.parent = parent
+        self.active = active
+        self.is_homepage = is_homepage
+        self.content = content
+        self.meta = meta
+        self.toc = toc
+        self.abs_url = abs_url
+        self.canonical_url = canonical_url
+        self.edit_url = edit_url
+        self.previous_page = previous_page
+        self.next_page = next_page
+
+    def __repr__(self):
+        return "Page(title={!r}, url={!r})".format(self.title, self.url)
+
+    def _indent_print(self, depth=0):
+        return '{}{}'.format('    ' * depth, repr(self))
+
+
+class Link:
+    __slots__ = ("title", "url", "parent")
+
+    # Guaranteed constants
+    children = None
+    active = False
+    is_section = False
+    is_page = False
+    is_link = True
+
+    def __init__(self, title, url, parent=None):
+        self.title = title
+        self.url = url
+        self.parent = parent
+
+    def __repr__(self):
+        return "Link(title={!r}, url={!r})".format(self.title, self.url)
+
+    def _indent_print(self, depth=0):
+        return '{}{}'.format('    ' * depth, repr(self))
+
+
+class ActiveItem:
+    """A shared navigation item, marked as active for a single page.
+
+    Everything other than `active` and `children` comes from the shared item.
+    """
+
+    __slots__ = ("item", "children")
+
+    active = True
+
+    def __init__(self, item, children):
+        self.item = item
+        self.children = children
+
+    def __getattr__(self, name):
+        return getattr(self.item, name)
+
+    def __repr__(self):
+        return repr(self.item)
+
+    def _indent_print(self, depth=0):
+        ret = ['{}{}'.format('    ' * depth, repr(self))]
+        for item in self.children or ():
+            ret.append(item._indent_print(depth + 1))
+        return '\n'.join(ret)
+
+
+class CollapsedItem:
+    """A shared navigation item, shown without its children.
+
+    Everything other than `children` comes from the shared item.
+    """
+
+    __slots__ = ("item",)
+
+    children = ()
+
+    def __init__(self, item):
+        self.item = item
+
+    def __getattr__(self, name):
+        return getattr(self.item, name)
+
+    def __repr__(self):
+        return repr(self.item)
+
+    def _indent_print(self, depth=0):
+        return '{}{}'.format('    ' * depth, repr(self))
+
+
+#
+# Permanently borrowed from the mkdocs' `toc.py`
+#
+class TableOfContents:
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __str__(self):
+        return ''.join([str(item) for item in self])
+
+
+class AnchorLink:
+    __slots__ = ("title", "id", "level", "children", "active")
+
+    def __init__(self, title, id, level):
+        self.title, self.id, self.level = title, id, level
+        self.children = []
+        self.active = False
+
+    @property
+    def url(self):
+        return '#' + self.id
+
+    def __str__(self):
+        return self.indent_print()
+
+    def indent_print(self, depth=0):
+        indent = '    ' * depth
+        ret = '{}{} - {}\n'.format(indent, self.title, self.url)
+        for item in self.children:
+            ret += item.indent_print(depth + 1)
+        return ret
@@ -0,0 +1,244 @@
+"""Derive mkdocs' navigation straight from Sphinx's build environment.
+
+This walks the toctrees that Sphinx has already collected while reading the
+documents, rather than rendering them to HTML and parsing that HTML again.
+"""
+
+from sphinx import addnodes
+from sphinx.util import url_re
+from sphinx.util.nodes import clean_astext
+
+from .model import ActiveItem, CollapsedItem, Link, Page, Section
+
+__all__ = [
+    "PageIndex",
+    "build_toctree",
+    "flatten_toctree",
+    "index_toctree",
+    "trim_path",
+    "activate_toctree",
+    "prune_toctree",
+    "serialize_toctree",
+]
+
+
+def _is_excluded(node, tags):
+    """Check if the node is within an ``.. only::`` that excludes it."""
+    parent = node.parent
+    while parent is not None:
+        if isinstance(parent, addnodes.only) and not tags.eval_condition(
+            parent["expr"]
+        ):
+            return True
+        parent = parent.parent
+    return False
+
+
+def _get_toctree_entries(env, docname, tags):
+    # `env.tocs` holds a copy of every toctree node in the document, in order,
+    # along with the explicit titles and external links that
+    # `env.toctree_includes` drops.
+    for toctreenode in env.tocs[docname].traverse(addnodes.toctree):
+        if _is_excluded(toctreenode, tags):
+            continue
+        for title, ref in toctreenode["entries"]:
+            yield title, ref, toctreenode["parent"]
+
+
+def _build_items(env, builder, docname, depth, maxdepth, parents):
+    retval = []
+    for title, ref, toctree_docname in _get_toctree_entries(env, docname, builder.tags):
+        if url_re.match(ref):
+            retval.append(Link(title=title or ref, url=ref))
+            continue
+
+        # 'self' refers to the document containing the toctree, and Sphinx
+        # doesn't show any subitems for it.
+        is_self = ref == "self"
+        if is_self:
+            ref = toctree_docname
+        elif ref in parents:
+            continue  # circular reference, Sphinx warns about these already.
+
+        if ref not in env.titles:
+            continue  # nonexistent document, Sphinx warns about these already.
+
+        children = []
+        if not is_self and (maxdepth < 0 or depth < maxdepth):
+            children = _build_items(
+                env, builder, ref, depth + 1, maxdepth, parents | {ref}
+            )
+
+        title = title or clean_astext(env.titles[ref])
+        # Like Sphinx, number the documents in `:numbered:` toctrees.
+        secnumber = env.toc_secnumbers.get(ref, {}).get("")
+        if secnumber:
+            title = "{}{}{}".format(
+                ".".join(map(str, secnumber)),
+                builder.config.html_secnumber_suffix,
+                title,
+            )
+        url = builder.get_target_uri(ref)
+        if children:
+            item = Section(title=title, url=url, children=children)
+            for child in children:
+                child.parent = item
+        else:
+            item = Page(title=title, url=url)
+        retval.append(item)
+
+    return retval
+
+
+def build_toctree(env, builder, maxdepth=-1):
+    """Build the site's toctree, starting from the master document.
+
+    This is equivalent to ``toctree(includehidden=True, collapse=False,
+    titles_only=True)`` in a Sphinx template, with the URLs being relative to
+    the root of the site instead of the current page.
+    """
+    master_doc = env.config.master_doc
+    if master_doc not in env.tocs:
+        return []
+    return _build_items(env, builder, master_doc, 1, maxdepth, frozenset())
+
+
+def flatten_toctree(toctree):
+    """Flatten the toctree into a list, in document order."""
+    retval = []
+    for item in toctree:
+        retval.append(item)
+        if item.children:
+            retval.extend(flatten_toctree(item.children))
+    return retval
+
+
+class PageIndex:
+    """The documents in the toctree, in document order, keyed by URL.
+
+    Every page is linked to the pages before and after it when the index is
+    created, so looking those up for a page does not need to search the
+    whole list.
+
+    Like in mkdocs, the `homepage` (if any) comes before everything else.
+    """
+
+    def __init__(self, toctree, homepage=None):
+        self.pages = []
+        self._by_url = {}
+        items = flatten_toctree(toctree)
+        if homepage is not None:
+            items.insert(0, homepage)
+        for item in items:
+            # Links are not pages, and a document can be in multiple toctrees.
+            if item.is_link or item.url in self._by_url:
+                continue
+            self._by_url[item.url] = item
+            self.pages.append(item)
+
+        previous_page = None
+        for page in self.pages:
+            page.previous_page = previous_page
+            page.next_page = None
+            if previous_page is not None:
+                previous_page.next_page = page
+            previous_page = page
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    def get(self, url):
+        return self._by_url.get(url)
+
+
+def index_toctree(toctree, path=(), retval=None):
+    """Map the URL of every item in the toctree, to its position in the tree."""
+    if retval is None:
+        retval = {}
+    for i, item in enumerate(toctree):
+        retval.setdefault(item.url, path + (i,))
+        if item.children:
+            index_toctree(item.children, path + (i,), retval)
+    return retval
+
+
+def trim_path(toctree, path):
+    """Cut `path` down to its longest prefix that exists in `toctree`."""
+    items = toctree
+    for depth, index in enumerate(path):
+        if not items or index >= len(items):
+            return path[:depth]
+        items = items[index].children
+    return path
+
+
+def activate_toctree(toctree, path):
+    """Mark the items at `path` as active, without modifying `toctree`.
+
+    Only the items along the path are wrapped, everything else is shared.
+    """
+    if not path:
+        return toctree
+
+    index, rest = path[0], path[1:]
+    current = toctree[index]
+
+    retval = toctree[:]
+    retval[index] = ActiveItem(
+        current,
+        children=(
+            activate_toctree(current.children, rest)
+            if current.children
+            else current.children
+        ),
+    )
+    return retval
+
+
+def _activate_path(toctree, path):
+    # Only the items on the path, see prune_toctree().
+    if not path:
+        return []
+    current = toctree[path[0]]
+    children = current.children
+    if children:
+        children = _activate_path(children, path[1:])
+    return [ActiveItem(current, children=children)]
+
+
+def prune_toctree(toctree, path):
+    """Like activate_toctree(), but only keeping what's needed to show `path`.
+
+    That's the top level of the toctree, and the items at `path` below it.
+    The other top level items are collapsed, instead of showing their children.
+    """
+    retval = []
+    for index, item in enumerate(toctree):
+        if path and index == path[0]:
+            retval.extend(_activate_path(toctree, path))
+        elif item.children:
+            retval.append(CollapsedItem(item))
+        else:
+            retval.append(item)
+    return retval
+
+
+def serialize_toctree(toctree):
+    """Convert the toctree into something that can be stored as JSON."""
+    retval = []
+    for item in toctree:
+        if item.is_section:
+            kind = "section"
+        elif item.is_link:
+            kind = "link"
+        else:
+            kind = "page"
+
+        data = {"title": item.title, "url": item.url, "type": kind}
+        if item.children:
+            data["children"] = serialize_toctree(item.children)
+        retval.append(data)
+    return retval
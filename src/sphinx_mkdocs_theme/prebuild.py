@@ -0,0 +1,19 @@
+"""Prebuild the search index, in a separate process.
+
+This only imports lunr, since it's imported again in the worker process when
+processes are spawned instead of forked (eg: on macOS and Windows).
+"""
+
+try:
+    from lunr import lunr
+except ImportError:
+    lunr = None
+
+__all__ = ["lunr", "prebuild_index"]
+
+
+def prebuild_index(entries, lang):
+    index = lunr(
+        ref="location", fields=("title", "text"), documents=entries, languages=lang,
+    )
+    return index.serialize()
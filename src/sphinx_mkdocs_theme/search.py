@@ -0,0 +1,163 @@
+"""A search index that only re-indexes pages that changed since the last build.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import mkdocs
+from mkdocs.contrib.search import SearchIndex
+
+from .prebuild import lunr, prebuild_index
+
+__all__ = ["CachedSearchIndex"]
+
+logger = logging.getLogger(__name__)
+
+
+def _get_digest(page):
+    digest = hashlib.sha256()
+    for value in (page.title, page.url, page.content):
+        digest.update((value or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CachedSearchIndex(SearchIndex):
+    """A SearchIndex, that remembers the entries of every page across builds.
+
+    Sphinx only writes the pages that changed, so the entries for the other
+    pages come from the cache stored at `cache_path`. Pages are keyed by their
+    URL, and only re-indexed if their content changed.
+
+    The "python" prebuilt index is built in a separate process, which is
+    given up on after `prebuild_timeout` seconds (None means no limit).
+    """
+
+    def __init__(self, cache_path, prebuild_timeout=None, **config):
+        super().__init__(**config)
+        self.cache_path = cache_path
+        # Values from `sphinx-build -D` are strings.
+        if prebuild_timeout is not None:
+            prebuild_timeout = float(prebuild_timeout)
+        self.prebuild_timeout = prebuild_timeout
+        self._pages = {}  # url -> (digest, entries)
+        self._updated = {}  # the subset of _pages indexed since take_updated()
+        self._executor = None
+        self._prebuild = None
+
+        # Anything that affects the entries needs to invalidate the cache.
+        self._cache_key = json.dumps(
+            [mkdocs.__version__, config], sort_keys=True, default=str
+        )
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get("key") != self._cache_key:
+            return
+        self._pages = {url: tuple(value) for url, value in data["pages"].items()}
+
+    def save(self):
+        data = {"key": self._cache_key, "pages": self._pages}
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with open(self.cache_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    def has_page(self, url):
+        """Check if the entries of the page at `url` are known."""
+        return url in self._pages
+
+    def add_entry_from_context(self, page):
+        digest = _get_digest(page)
+        cached = self._pages.get(page.url)
+        if cached is not None and cached[0] == digest:
+            return
+
+        # Index into a separate SearchIndex, so that pages can be indexed from
+        # multiple threads at once.
+        index = SearchIndex(**self.config)
+        index.add_entry_from_context(page)
+        self._pages[page.url] = self._updated[page.url] = (digest, index._entries)
+
+    def take_updated(self):
+        """Get (and forget) the pages that were indexed since the last call.
+
+        This is used to send the pages indexed in a worker process, back to
+        the main process, where they're passed to :meth:`merge`.
+        """
+        retval, self._updated = self._updated, {}
+        return retval
+
+    def merge(self, pages):
+        self._pages.update(pages)
+
+    def select(self, urls):
+        """Use the entries of the pages at `urls`, in that order.
+
+        Pages that aren't in `urls` (eg: deleted documents) are forgotten.
+        """
+        self._pages = {url: self._pages[url] for url in urls if url in self._pages}
+        self._entries = [
+            entry for _, entries in self._pages.values() for entry in entries
+        ]
+
+    def start_prebuild(self):
+        """Start prebuilding the index, in a separate process.
+
+        This should be called once all the entries have been added, and as
+        early as possible, since it can take a while on larger sites.
+        """
+        if self.config["prebuild_index"] != "python" or lunr is None:
+            return  # Nothing to do, or let mkdocs handle (and warn about) it.
+
+        self._executor = ProcessPoolExecutor(1)
+        self._prebuild = self._executor.submit(
+            prebuild_index, self._entries, self.config["lang"]
+        )
+
+    def _stop_prebuild(self):
+        # Shutting down waits for the task, which is what the timeout is meant
+        # to avoid. So the worker is stopped if it's still running.
+        if not self._prebuild.done():
+            processes = getattr(self._executor, "_processes", None) or {}
+            for process in list(processes.values()):
+                process.terminate()
+        self._executor.shutdown()
+        self._executor = self._prebuild = None
+
+    def generate_search_index(self):
+        if self._prebuild is None:
+            return super().generate_search_index()
+
+        page_dicts = {"docs": self._entries, "config": self.config}
+        try:
+            page_dicts["index"] = self._prebuild.result(self.prebuild_timeout)
+        except FutureTimeoutError:
+            logger.warning(
+                "Prebuilding the search index took more than %s seconds, "
+                "writing it without a prebuilt index.",
+                self.prebuild_timeout,
+            )
+        except Exception as exc:
+            # Including the worker dying, which raises BrokenProcessPool.
+            logger.warning(
+                "Prebuilding the search index failed (%s), "
+                "writing it without a prebuilt index.",
+                exc,
+            )
+        finally:
+            self._stop_prebuild()
+
+        return json.dumps(
+            page_dicts, sort_keys=True, separators=(",", ":"), default=str
+        )
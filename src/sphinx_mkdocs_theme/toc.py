@@ -0,0 +1,86 @@
+"""Derive mkdocs' per-page table of contents from Sphinx's build environment.
+
+Sphinx collects the sections of every document into `env.tocs` while reading
+it. These are converted once per read, and stored in the environment, so that
+documents that are written again without being read again (eg: when a theme's
+template changed) don't need to convert them again.
+"""
+
+from docutils import nodes
+from sphinx import addnodes
+from sphinx.environment.collectors import EnvironmentCollector
+
+from .model import AnchorLink, TableOfContents
+
+__all__ = ["PageTocCollector", "build_page_toc", "get_page_toc"]
+
+
+def _build_links(node, tags, level, title_id):
+    retval = []
+    for child in node.children:
+        if isinstance(child, addnodes.only):
+            if tags.eval_condition(child["expr"]):
+                retval.extend(_build_links(child, tags, level, title_id))
+            continue
+        if not isinstance(child, nodes.list_item):
+            continue  # toctrees, which are in the site navigation instead.
+
+        reference = child.next_node(nodes.reference)
+        # The first entry is the document's title, which has no anchor.
+        anchor = reference["anchorname"][1:] or title_id
+        link = AnchorLink(reference.astext(), anchor, level)
+        for sublist in child.children:
+            if isinstance(sublist, nodes.bullet_list):
+                link.children.extend(_build_links(sublist, tags, level + 1, ""))
+        retval.append(link)
+    return retval
+
+
+def build_page_toc(toc, tags, title_id=""):
+    """Build the table of contents of a page, from its entry in `env.tocs`.
+
+    `title_id` is the ID of the document's title, which isn't in `env.tocs`.
+    Like mkdocs, the first item is marked as active.
+    """
+    items = _build_links(toc, tags, 1, title_id)
+    if items:
+        items[0].active = True
+    return TableOfContents(items)
+
+
+def _get_stored_tocs(env):
+    if not hasattr(env, "mkdocs_page_tocs"):
+        env.mkdocs_page_tocs = {}
+    return env.mkdocs_page_tocs
+
+
+def get_page_toc(env, docname):
+    """Get the table of contents of `docname`, as collected by PageTocCollector."""
+    # Pages that aren't documents (eg: genindex) don't have one.
+    return _get_stored_tocs(env).get(docname) or TableOfContents([])
+
+
+class PageTocCollector(EnvironmentCollector):
+    """Store the table of contents of every document, as it is read.
+
+    This is registered after Sphinx's TocTreeCollector, which fills `env.tocs`.
+    """
+
+    def clear_doc(self, app, env, docname):
+        _get_stored_tocs(env).pop(docname, None)
+
+    def merge_other(self, app, env, docnames, other):
+        tocs, other_tocs = _get_stored_tocs(env), _get_stored_tocs(other)
+        for docname in docnames:
+            if docname in other_tocs:
+                tocs[docname] = other_tocs[docname]
+
+    def process_doc(self, app, doctree):
+        env = app.env
+        title_id = ""
+        section = doctree.next_node(nodes.section)
+        if section is not None and section["ids"]:
+            title_id = section["ids"][0]
+        _get_stored_tocs(env)[env.docname] = build_page_toc(
+            env.tocs[env.docname], app.builder.tags, title_id
+        )
@@ -3,93 +3,149 @@
 This single file represents most of the hard-fought knowledge for this project.
 """
 
+import os
 import pprint
-from types import SimpleNamespace
+import threading
+from functools import partial
 
-import bs4
 import mkdocs
-from mkdocs.contrib.search import SearchIndex
 
 import sphinx
+from sphinx.util.nodes import clean_astext
 import sphinx_mkdocs_theme as this_project
-from .model import Navigation
+from .model import Navigation, Page
+from .navigation import (
+    PageIndex,
+    activate_toctree,
+    build_toctree,
+    flatten_toctree,
+    index_toctree,
+    prune_toctree,
+    serialize_toctree,
+    trim_path,
+)
+from .toc import get_page_toc
 
 
-__all__ = ["ContextTranslator"]
+__all__ = ["ContextTranslator", "LazyValue"]
 
-#
-# HTML Processing!
-#
-Link = Section = Page = SimpleNamespace
 
+class ReadOnlyDict(dict):
+    """A dict that can't be modified, but is still JSON serializable."""
 
-def _handle_ul_in_toctree(ul_element, parent=None):
-    retval = []
-    for li_element in ul_element.find_all("li", recursive=False):
-        # Extract the basic information
-        title = li_element.a.text
-        url = li_element.a.attrs["href"]
-        active = "current" in li_element.attrs.get("class", [])
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("{} is read-only".format(type(self).__name__))
 
-        # Does it have a "ul" tag in it?
-        if li_element.ul:
-            children = _handle_ul_in_toctree(li_element.ul)
-            cls = Section
-        else:
-            children = None
-            cls = Link
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
 
-        item = cls(
-            title=title, parent=parent, active=active, children=children, url=url,
-        )
-        retval.append(item)
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+
+_MISSING = object()
+
+
+class LazyValue:
+    """A value that is computed by `func`, the first time it's used.
+
+    Jinja copies the context when a template includes another one, so putting
+    these in the context (instead of computing the values) means that only
+    the values a template actually uses are computed.
+    """
+
+    __slots__ = ("_func", "_value")
+
+    def __init__(self, func):
+        self._func = func
+        self._value = _MISSING
 
-    return retval
+    @property
+    def computed(self):
+        return self._value is not _MISSING
 
+    def _get(self):
+        if self._value is _MISSING:
+            self._value = self._func()
+        return self._value
 
-def convert_toctree(html):
-    soup = bs4.BeautifulSoup(html, features="html.parser")
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
 
-    # TODO: rewrite this?
+    def __getitem__(self, key):
+        return self._get()[key]
 
-    retval = []
-    for element in soup.children:
-        # Nothing to do with strings here.
-        if isinstance(element, str):
-            continue
-        # TODO: handle captions
-        # <p class="caption"><span class="caption-text">Top Level</span></p>
-        if element.name != "ul":
-            continue
-        retval.extend(_handle_ul_in_toctree(element))
-    return retval
+    def __iter__(self):
+        return iter(self._get())
 
+    def __len__(self):
+        return len(self._get())
 
-def flatten_toctree(toctree):
-    retval = []
-    to_process = toctree[:]
-    while to_process:
-        current = to_process.pop()
-        retval.append(current)
+    def __contains__(self, item):
+        return item in self._get()
+
+    def __bool__(self):
+        return bool(self._get())
+
+    def __eq__(self, other):
+        return self._get() == other
+
+    def __ne__(self, other):
+        return self._get() != other
+
+    def __hash__(self):
+        return hash(self._get())
+
+    def __str__(self):
+        return str(self._get())
+
+    def __repr__(self):
+        return repr(self._get())
+
+
+def freeze(value):
+    """Make a read-only copy of nested dicts and lists."""
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, freeze(val)) for key, val in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(val) for val in value)
+    return value
 
-        if current.children:
-            to_process.extend(current.children)
-    return retval
 
 #
 # The main attraction!
 #
 class ContextTranslator:
+    """Translates Sphinx's context into an mkdocs one, for every render.
+
+    This is shared by all the pages in a build (and possibly, by multiple
+    threads rendering them), so the per-render state is passed around
+    explicitly instead of being stored on the instance.
+    """
+
     def __init__(self, app, theme):
         self.app = app
         self.theme = theme
 
-        self.sphinx_context = None
-        self.template_name = None
+        # Memoized by get_config()
+        self.config = None
+        self.config_key = None
+
+        # Populated once per build, by build_site_navigation()
+        self.nav_items = None
+        self.nav_pages = None
+        self.nav_index = None
+        self.page_index = None
+        self._navigation_lock = threading.Lock()
 
         self.indexer = None
         if app.builder.search:
-            self.indexer = SearchIndex(
+            from .search import CachedSearchIndex
+
+            self.indexer = CachedSearchIndex(
+                cache_path=os.path.join(app.doctreedir, "mkdocs_search_index.json"),
+                prebuild_timeout=app.config.mkdocs_search_prebuild_timeout,
                 prebuild_index="python",
                 lang=app.config.language or ["en"],
                 site_dir=app.builder.outdir,
@@ -97,32 +153,15 @@ class ContextTranslator:
             )
 
     def translate(self, sphinx_context, template_name):
-        self.sphinx_context = sphinx_context
         if template_name == "page.html":
-            self.template_name = "main.html"
-        else:
-            self.template_name = template_name
-
-        config = self.get_config()
-        nav = self.get_site_navigation()
-        all_pages = self.get_all_pages()
-        page = self.get_page_details()
-
-        if self.indexer:
-            self.indexer.add_entry_from_context(page)
+            template_name = "main.html"
 
         base_url = "."  # HACK: somehow, this works?
         extra_css = sphinx_context["css_files"]
         extra_javascript = sphinx_context["script_files"]
 
         # Based on reading `mkdocs.commands.build`
-        mkdocs_context = {
-            "config": config,
-            # navigation
-            "nav": nav,
-            "pages": all_pages,
-            # this page
-            "page": page,
+        values = {
             "base_url": base_url,
             # assets
             "extra_css": extra_css,
@@ -133,16 +172,43 @@ class ContextTranslator:
                 f"using sphinx-mkdocs-theme {this_project.__version__}"
             ),
             "build_date_utc": sphinx_context["last_updated"],
-            # Because, Sphinx makes assumptions internally
-            "encoding": sphinx_context["encoding"],
+            # Because, Sphinx makes assumptions internally (only for pages)
+            "encoding": sphinx_context.get("encoding"),
         }
-        return mkdocs_context, self.template_name
+
+        # These don't depend on the page, or are only computed once per build.
+        values["config"] = self.get_config(sphinx_context)
+        values["pages"] = self.get_all_pages()
+
+        # These are only computed if the template actually uses them.
+        values["nav"] = LazyValue(partial(self.get_site_navigation, sphinx_context))
+        if "pagename" in sphinx_context:
+            # Only documents go into the search index, not other pages.
+            if self.indexer and "body" in sphinx_context:
+                values["page"] = self.get_page_details(sphinx_context)
+                self.indexer.add_entry_from_context(values["page"])
+            else:
+                values["page"] = LazyValue(
+                    partial(self.get_page_details, sphinx_context)
+                )
+        return values, template_name
 
     # https://mkdocs.readthedocs.io/en/latest/user-guide/custom-themes/#config
-    def get_config(self):
-        theme = self._convert_sphinx_theme_config()
+    def get_config(self, sphinx_context):
+        # Everything in here is the same for every page in the build, unless
+        # something changes the theme options in the middle of it.
+        key = self.app.builder.theme_options
+        config, config_key = self.config, self.config_key
+        if config is None or key != config_key:
+            config = freeze(self._compute_config(sphinx_context))
+            # Racing threads would compute the same thing, so this is fine.
+            self.config, self.config_key = config, dict(key)
+        return config
+
+    def _compute_config(self, sphinx_context):
+        theme = self._convert_sphinx_theme_config(sphinx_context)
         extra = theme.pop("extra", {})
-        plugins = theme.pop("plugins", [])
+        plugins = list(theme.pop("plugins", []))
         google_analytics = theme.pop("google_analytics", None)
 
         if self.indexer:
@@ -152,8 +218,8 @@ class ContextTranslator:
             "theme": theme,
             "extra": extra,
             "plugins": plugins,
-            "copyright": "Copyright &copy; " + self.sphinx_context["copyright"],
-            "site_name": self.sphinx_context["docstitle"],
+            "copyright": "Copyright &copy; " + sphinx_context["copyright"],
+            "site_name": sphinx_context["docstitle"],
             "site_author": self.app.config.author,
             # TODO: figure out the rest!
             "site_url": None,
@@ -164,7 +230,7 @@ class ContextTranslator:
             "google_analytics": google_analytics,
         }
 
-    def _convert_sphinx_theme_config(self):
+    def _convert_sphinx_theme_config(self, sphinx_context):
         """Convert Sphinx's theme_* variables into mkdocs' `theme` object."""
         theme_config = {}
 
@@ -173,27 +239,81 @@ class ContextTranslator:
 
         # Load from html_theme_config
         prefix = "theme_"
-        for key, value in self.sphinx_context.items():
+        for key, value in sphinx_context.items():
             if not key.startswith(prefix):
                 continue
 
             name = key[len(prefix) :]
             theme_config[name] = value
 
-        if self.sphinx_context["language"]:
-            theme_config["language"] = self.sphinx_context["language"]
+        if sphinx_context["language"]:
+            theme_config["language"] = sphinx_context["language"]
 
         return theme_config
 
-    # https://mkdocs.readthedocs.io/en/latest/user-guide/custom-themes/#nav
-    def get_site_navigation(self):
-        toctree = self.sphinx_context["toctree"]
+    def build_site_navigation(self):
+        """Compute the navigation and pages that are shared by every page.
 
-        nav_html = toctree(
-            maxdepth=2, includehidden=True, collapse=False, titles_only=True,
-        )
-        items = convert_toctree(nav_html)
-        pages = flatten_toctree(items)
+        This needs the toctrees of all documents, so it has to be called after
+        the environment has been read, but before any page is rendered.
+        """
+        env, builder = self.app.env, self.app.builder
+
+        self.nav_items = build_toctree(env, builder, maxdepth=2)
+        self.nav_pages = flatten_toctree(self.nav_items)
+
+        toctree = build_toctree(env, builder)
+        # Pages deeper than the navigation get the path of their ancestor in it.
+        self.nav_index = {
+            url: trim_path(self.nav_items, path)
+            for url, path in index_toctree(toctree).items()
+        }
+        # The master document isn't in its own toctree, but is linked to the
+        # pages in it by Sphinx too.
+        homepage = None
+        master_doc = env.config.master_doc
+        if master_doc in env.titles:
+            homepage = Page(
+                title=clean_astext(env.titles[master_doc]),
+                url=builder.get_target_uri(master_doc),
+            )
+        # This is set last, since it's used to check if all this is done.
+        self.page_index = PageIndex(toctree, homepage=homepage)
+
+    def _ensure_site_navigation(self):
+        # In case something renders a page before prepare_writing().
+        if self.page_index is None:
+            with self._navigation_lock:
+                if self.page_index is None:
+                    self.build_site_navigation()
+
+    def get_nav_path(self, url):
+        """Get the position of the page at `url` in the site navigation.
+
+        Pages that aren't in the site navigation get an empty path.
+        """
+        self._ensure_site_navigation()
+        return self.nav_index.get(url, ())
+
+    # https://mkdocs.readthedocs.io/en/latest/user-guide/custom-themes/#nav
+    def get_site_navigation(self, sphinx_context):
+        self._ensure_site_navigation()
+
+        # Static files are rendered without a page, so nothing is active there.
+        items = self.nav_items
+        pagename = sphinx_context.get("pagename")
+        shared_url = None
+        if self.app.config.mkdocs_nav_mode == "shared":
+            # Only what's needed for this page, the rest is in a separate file.
+            path = ()
+            if pagename is not None:
+                path = self.get_nav_path(self.app.builder.get_target_uri(pagename))
+            items = prune_toctree(items, path)
+            shared_url = self.app.builder.navigation_filename.replace(os.sep, "/")
+        elif pagename is not None:
+            url = self.app.builder.get_target_uri(pagename)
+            items = activate_toctree(items, self.get_nav_path(url))
+        pages = self.nav_pages
 
         homepage = Page(
             title="Home",
@@ -206,60 +326,56 @@ class ContextTranslator:
             abs_url=None,
             canonical_url=None,
             edit_url=None,
-            previous_page=None,
-            next_page=None,
-            parent=None,
-            # Guaranteed constants
-            children=None,
             active=True,
-            is_section=False,
-            is_page=True,
-            is_link=False,
         )
-        return Navigation(items, homepage=homepage, pages=pages)
+        return Navigation(
+            items, homepage=homepage, pages=pages, shared_url=shared_url
+        )
+
+    def get_shared_navigation(self):
+        """Get the full site navigation, for the "shared" mkdocs_nav_mode."""
+        self._ensure_site_navigation()
+        return {"homepage": "", "items": serialize_toctree(self.nav_items)}
 
     # https://mkdocs.readthedocs.io/en/latest/user-guide/custom-themes/#pages
     def get_all_pages(self):
-        toctree = self.sphinx_context["toctree"]
+        self._ensure_site_navigation()
 
-        all_pages_html = toctree(
-            maxdepth=-1, includehidden=True, collapse=False, titles_only=True,
-        )
-        items = convert_toctree(all_pages_html)
-        return flatten_toctree(items)
+        # This is the same list for every page, so there's nothing to copy.
+        return self.page_index.pages
 
     # https://mkdocs.readthedocs.io/en/latest/user-guide/custom-themes/#page
-    def get_page_details(self):
+    def get_page_details(self, sphinx_context):
+        pagename = sphinx_context["pagename"]
+        master_doc = sphinx_context["master_doc"]
         # This is used by the mkdocs's provided "url" filter, so this is trying
-        # to make things "just work".
-        pagename = self.sphinx_context["pagename"]
-        master_doc = self.sphinx_context["master_doc"]
-        if pagename.endswith("index"):
-            url = pagename[:-6]
+        # to make things "just work". It also needs to match the URLs in `nav`.
+        url = self.app.builder.get_target_uri(pagename)
+
+        self._ensure_site_navigation()
+        # Pages outside the toctree (eg: search) don't have any of these.
+        indexed = self.page_index.get(url)
+        if indexed is not None:
+            previous_page = indexed.previous_page
+            next_page = indexed.next_page
+            parent = indexed.parent
         else:
-            url = pagename + "/"
-
-        toc = self.sphinx_context["toc"]
+            previous_page = next_page = parent = None
 
         page = Page(
-            title=self.sphinx_context.get("title", None),
-            content=self.sphinx_context.get("body", None),
-            meta=self.sphinx_context.get("meta", None),
+            title=sphinx_context.get("title", None),
+            content=sphinx_context.get("body", None),
+            meta=sphinx_context.get("meta", None),
             url=url,
             is_homepage=pagename == master_doc,
+            toc=get_page_toc(self.app.env, pagename),
             # TODO: figure these out!
-            toc=[],
             abs_url=None,
             canonical_url=None,
             edit_url=None,
-            previous_page=None,
-            next_page=None,
-            parent=None,
-            # Guaranteed constants
-            children=None,
+            previous_page=previous_page,
+            next_page=next_page,
+            parent=parent,
             active=True,
-            is_section=False,
-            is_page=True,
-            is_link=False,
         )
         return page
@@ -0,0 +1,119 @@
+"""Tests for the rules that OutputManifest.expire() removes files by."""
+
+import pytest
+
+from sphinx_mkdocs_theme.assets import OutputManifest
+
+
+@pytest.fixture
+def outdir(tmp_path):
+    path = tmp_path / "out"
+    path.mkdir()
+    return path
+
+
+def start_build(tmp_path, outdir):
+    """Get the manifest, as a new build would."""
+    return OutputManifest(str(tmp_path / "manifest.json"), str(outdir))
+
+
+def finish_build(manifest, is_current):
+    removed = manifest.expire(is_current)
+    manifest.save(str(manifest.path) + ".changes", removed)
+    return removed
+
+
+def write(manifest, outdir, key, owner=None):
+    path = outdir / key
+    path.parent.mkdir(parents=True, exist_ok=True)
+    manifest.write(str(path), key.encode(), owner=owner)
+
+
+def test_keeps_files_written_in_this_build(tmp_path, outdir):
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "index.html", owner="index")
+    write(manifest, outdir, "css/base.css")
+
+    assert finish_build(manifest, lambda owner: False) == []
+    assert (outdir / "index.html").exists()
+    assert (outdir / "css" / "base.css").exists()
+
+
+def test_keeps_pages_of_current_documents(tmp_path, outdir):
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "index.html", owner="index")
+    write(manifest, outdir, "one/index.html", owner="one")
+    finish_build(manifest, {"index", "one"}.__contains__)
+
+    # Only "index" changed, so "one" isn't written again.
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "index.html", owner="index")
+
+    assert finish_build(manifest, {"index", "one"}.__contains__) == []
+    assert (outdir / "one" / "index.html").exists()
+
+
+def test_removes_pages_of_removed_documents(tmp_path, outdir):
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "index.html", owner="index")
+    write(manifest, outdir, "sub/one/index.html", owner="sub/one")
+    finish_build(manifest, {"index", "sub/one"}.__contains__)
+
+    manifest = start_build(tmp_path, outdir)
+
+    removed = finish_build(manifest, {"index"}.__contains__)
+    assert removed == ["sub/one/index.html"]
+    assert (outdir / "index.html").exists()
+    # The directories that are left empty are removed too.
+    assert not (outdir / "sub").exists()
+
+
+def test_keeps_images(tmp_path, outdir):
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "_images/logo.png", owner="_images")
+    finish_build(manifest, {"_images"}.__contains__)
+
+    # Sphinx only copies the images used by the documents written in a build.
+    manifest = start_build(tmp_path, outdir)
+
+    assert finish_build(manifest, {"_images"}.__contains__) == []
+    assert (outdir / "_images" / "logo.png").exists()
+
+
+def test_removes_assets_that_were_not_written(tmp_path, outdir):
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "css/base.css")
+    write(manifest, outdir, "css/old.css")
+    finish_build(manifest, lambda owner: True)
+
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "css/base.css")
+
+    # Assets are written in every build, regardless of is_current.
+    assert finish_build(manifest, lambda owner: True) == ["css/old.css"]
+    assert (outdir / "css" / "base.css").exists()
+
+
+def test_removes_compressed_variants_that_were_not_written(tmp_path, outdir):
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "index.html", owner="index")
+    write(manifest, outdir, "index.html.gz")
+    finish_build(manifest, {"index"}.__contains__)
+
+    # Compression is turned off, and the page didn't change.
+    manifest = start_build(tmp_path, outdir)
+
+    assert finish_build(manifest, {"index"}.__contains__) == ["index.html.gz"]
+    assert (outdir / "index.html").exists()
+
+
+def test_forgets_pages_that_were_deleted_by_something_else(tmp_path, outdir):
+    manifest = start_build(tmp_path, outdir)
+    write(manifest, outdir, "index.html", owner="index")
+    finish_build(manifest, {"index"}.__contains__)
+    (outdir / "index.html").unlink()
+
+    manifest = start_build(tmp_path, outdir)
+
+    assert finish_build(manifest, {"index"}.__contains__) == ["index.html"]
+    assert manifest.get_current({"index"}.__contains__) == {}